@@ -19,6 +19,8 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import json
+import os
 import time
 import serial
 from tracer import *
@@ -64,6 +66,9 @@ I2C_SPEED_400KHZ = 0x03
 I2C_SPEED_100KHZ = 0x02
 I2C_SPEED_50KHZ = 0x01
 I2C_SPEED_5KHZ = 0x00
+# Supported speeds, fastest first, with their nominal bus clock in kHz.
+I2C_SPEEDS = ((I2C_SPEED_400KHZ, 400), (I2C_SPEED_100KHZ, 100),
+              (I2C_SPEED_50KHZ, 50), (I2C_SPEED_5KHZ, 5))
 BULK = 0x10
 
 set_binary_mode = BpCommand(b"\x00", b"BBIO1", "binary mode")
@@ -73,19 +78,32 @@ set_ow_mode = BpCommand(b"\x04", b"1W01", "one wire mode")
 set_raw_mode = BpCommand(b"\x05", b"RAW1", "raw mode")
 reset = BpCommand(b"\x0F", None, "reset")
 
+# Calibrated link profiles, keyed by port name.
+PROFILE_FILE = os.path.join(os.path.expanduser("~"),
+                            ".bus_pirate_profiles.json")
+
 bp_port = None
 binary_mode = None
 i2c_mode = None
 
 
+class NoResponse(Exception):
+    """ The Bus Pirate did not respond in time. """
+    pass
+
+
 def init(port, port_speed):
     """ Configure the Bus Pirate communications channel
 
     :param port: The port to use e.g. windows com port
     :param port_speed: The com port speed
+
+    Calling init again closes any previously opened port first.
     """
     tracer("BusPirate init")
     global bp_port, binary_mode, i2c_mode
+    if bp_port is not None:
+        bp_port.close()
     bp_port = serial.Serial(port, port_speed)
     binary_mode = False
     i2c_mode = False
@@ -154,15 +172,22 @@ def discard_input():
         bp_port.read(1)
 
 
-def enter_i2c_mode():
-    """ Put Bus Pirate into I2C mode """
+def enter_i2c_mode(speed=None):
+    """ Put Bus Pirate into I2C mode
+
+    :param speed: One of the I2C_SPEED_xxx values. If None, 100kHz is used
+        on entry and an already set speed is left alone.
+    """
     global i2c_mode
     if not i2c_mode:
         enter_binary_mode()
         set_i2c_mode()
         i2c_mode = True
         config_i2c_peripherals(I2C_POWER | I2C_PULL_UPS)
-        set_i2c_speed(I2C_SPEED_100KHZ)
+        if speed is None:
+            speed = I2C_SPEED_100KHZ
+    if speed is not None:
+        set_i2c_speed(speed)
 
 
 def enter_binary_mode():
@@ -172,13 +197,164 @@ def enter_binary_mode():
         binary_mode = True
         reset()
         # TODO: Improve binary mode sensitive startup sequence if possible
-        bp_port.write(
-            b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
-            b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00")
-        time.sleep(0.1)
+        send_zero_burst()
         set_binary_mode()
 
 
+def probe_binary_mode():
+    """ Check whether the Bus Pirate answers the binary mode handshake.
+
+    :return: True if the Bus Pirate is now in binary mode
+
+    Unlike enter_binary_mode() a wrong or missing response does not end the
+    program, so a caller can find out whether a port speed works. The Bus
+    Pirate may start in interactive mode or in any binary mode: the first
+    zero burst gets it to binary mode, and the reset then brings it back to
+    interactive mode before binary mode is entered as enter_binary_mode()
+    does.
+    """
+    global binary_mode, i2c_mode
+    binary_mode = False
+    i2c_mode = False
+    resp_check = bytearray()
+    try:
+        send_zero_burst()
+        reset()
+        send_zero_burst()
+        port_write(set_binary_mode.code)
+        for _ in range(len(set_binary_mode.required)):
+            resp_check.extend(read_byte())
+    except NoResponse:
+        return False
+    trace_read_data(resp_check)
+    binary_mode = resp_check == set_binary_mode.required
+    return binary_mode
+
+
+def send_zero_burst():
+    """ Send the zero bytes that switch the Bus Pirate to binary mode. """
+    bp_port.write(
+        b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+        b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+    time.sleep(0.1)
+    discard_input()
+
+
+def measure_link(workload, iterations):
+    """ Run a verified workload over the I2C bus and time it.
+
+    :param workload: Called with the iteration number, returns True if the
+        data read back matched what was written.
+    :param iterations: Number of times to call the workload
+    :return: (verified round trips per second, error rate)
+
+    A Bus Pirate that stops responding counts as a failed iteration.
+    """
+    errors = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        try:
+            if not workload(i):
+                errors += 1
+        except NoResponse:
+            errors += 1
+            discard_input()
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    return (iterations - errors) / elapsed, errors / iterations
+
+
+def restart_i2c_mode(speed):
+    """ Bring the Bus Pirate back to I2C mode at a speed.
+
+    :param speed: One of the I2C_SPEED_xxx values
+    :return: True if the Bus Pirate is in I2C mode at that speed
+
+    Works whatever mode the Bus Pirate was left in, and returns False
+    rather than ending the program if it does not respond.
+    """
+    if not probe_binary_mode():
+        return False
+    try:
+        enter_i2c_mode(speed)
+    except NoResponse:
+        return False
+    return True
+
+
+def calibrate(port, workload, iterations=20, max_error_rate=0.0):
+    """ Find the fastest reliable I2C speed and save it for the port.
+
+    :param port: The port to use e.g. windows com port, already opened
+        with init()
+    :param workload: See measure_link()
+    :param iterations: Workload iterations per I2C speed
+    :param max_error_rate: Highest error rate counted as reliable
+    :return: The chosen profile, or None if nothing was reliable
+
+    The I2C speeds are tried fastest first, each from a fresh restart of I2C
+    mode so that a speed which hangs the Bus Pirate only fails its own step.
+    The first speed within max_error_rate is left active and saved. The
+    measured throughput is kept in the profile for reporting. With nothing
+    reliable the link is put back to 100kHz and nothing is saved.
+    """
+    tracer("BusPirate calibrate")
+    for speed, khz in I2C_SPEEDS:
+        if not restart_i2c_mode(speed):
+            tracer("  I2C " + str(khz) + "kHz : no response")
+            continue
+        throughput, error_rate = measure_link(workload, iterations)
+        tracer("  I2C " + str(khz) + "kHz : " + format(throughput, ".1f") +
+               " round trips/s, error rate " + format(error_rate, ".3f"))
+        if error_rate <= max_error_rate:
+            profile = {"i2c_speed": speed, "throughput": throughput,
+                       "error_rate": error_rate}
+            save_profile(port, profile)
+            return profile
+    tracer("  no reliable I2C speed found")
+    restart_i2c_mode(I2C_SPEED_100KHZ)
+    return None
+
+
+def load_profile(port):
+    """ Read the calibrated profile saved for a port.
+
+    :param port: The port to use e.g. windows com port
+    :return: The profile, or None if the port has not been calibrated or
+        the saved profile is not usable
+    """
+    try:
+        with open(PROFILE_FILE) as f:
+            profiles = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(profiles, dict):
+        return None
+    profile = profiles.get(port)
+    if not isinstance(profile, dict):
+        return None
+    if profile.get("i2c_speed") not in [speed for speed, _ in I2C_SPEEDS]:
+        return None
+    return profile
+
+
+def save_profile(port, profile):
+    """ Save a calibrated profile for a port, keeping other ports' profiles.
+
+    :param port: The port to use e.g. windows com port
+    :param profile: As returned by calibrate()
+    """
+    try:
+        with open(PROFILE_FILE) as f:
+            profiles = json.load(f)
+    except (IOError, ValueError):
+        profiles = {}
+    if not isinstance(profiles, dict):
+        profiles = {}
+    profiles[port] = profile
+    with open(PROFILE_FILE, "w") as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+
+
 def cleanup():
     """ Put the Bus Pirate back to interactive mode """
     global binary_mode
@@ -256,7 +432,7 @@ def read_byte():
     :return: a single byte
 
     Up to 1s is given for the Bus Pirate to respond and provide data to read.
-    If data us not available after 1s an exception is raised.
+    If data us not available after 1s NoResponse is raised.
     """
     global bp_port
     num_waiting = bp_port.inWaiting()
@@ -266,5 +442,5 @@ def read_byte():
         time.sleep(0.01)
         num_waiting = bp_port.inWaiting()
     if num_waiting < 1:
-        raise BaseException("ERROR: No response")
+        raise NoResponse("ERROR: No response")
     return port_read()
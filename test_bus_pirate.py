@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for the Bus Pirate link calibration that need no hardware.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import pytest
+import bus_pirate
+
+
+class FakePort:
+    """ Answers like a Bus Pirate in interactive, binary and I2C mode.
+
+    Speed commands for the I2C speeds in hang_speeds get no response, and a
+    dead port never responds at all.
+    """
+    def __init__(self, mode="interactive", hang_speeds=(), dead=False):
+        self.mode = mode
+        self.hang_speeds = hang_speeds
+        self.dead = dead
+        self.i2c_speed = None
+        self.zeros = 0
+        self.written = bytearray()
+        self.pending = bytearray()
+
+    def inWaiting(self):
+        return len(self.pending)
+
+    def read(self, num):
+        data = bytes(self.pending[:num])
+        del self.pending[:num]
+        return data
+
+    def write(self, data):
+        self.written.extend(data)
+        if self.dead:
+            return
+        for c in bytes(data):
+            self.pending.extend(self.respond(c))
+
+    def respond(self, c):
+        if self.mode == "interactive":
+            if c != 0x00:
+                self.zeros = 0
+                return bytes([c])  # echo
+            self.zeros += 1
+            if self.zeros < 20:
+                return b""
+            self.zeros = 0
+            self.mode = "binary"
+            return b"BBIO1"
+        if c == 0x00:
+            self.mode = "binary"
+            return b"BBIO1"
+        if self.mode == "binary":
+            if c == 0x02:
+                self.mode = "i2c"
+                return b"I2C1"
+            if c == 0x0F:
+                self.mode = "interactive"
+            return b"\x01"
+        if c & 0xF0 == 0x60:
+            if c & 0x0F in self.hang_speeds:
+                return b""
+            self.i2c_speed = c & 0x0F
+        return b"\x01"
+
+
+@pytest.fixture
+def fake_port(monkeypatch, tmp_path):
+    """ Install a FakePort with no sleeping and a temporary PROFILE_FILE. """
+    def install(**kwargs):
+        port = FakePort(**kwargs)
+        monkeypatch.setattr(bus_pirate, "bp_port", port)
+        monkeypatch.setattr(bus_pirate, "binary_mode",
+                            port.mode != "interactive")
+        monkeypatch.setattr(bus_pirate, "i2c_mode", port.mode == "i2c")
+        return port
+    monkeypatch.setattr(bus_pirate.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(bus_pirate, "PROFILE_FILE",
+                        str(tmp_path / "profiles.json"))
+    return install
+
+
+def test_measure_link_throughput_and_error_rate(monkeypatch):
+    times = iter([10.0, 12.0])
+    monkeypatch.setattr(bus_pirate.time, "perf_counter", lambda: next(times))
+
+    def workload(i):
+        return i % 4 != 0
+
+    throughput, error_rate = bus_pirate.measure_link(workload, 8)
+    assert throughput == 3.0  # 6 verified round trips in 2 seconds
+    assert error_rate == 0.25
+
+
+def test_measure_link_counts_no_response_as_error(fake_port):
+    fake_port()
+
+    def workload(i):
+        if i == 1:
+            raise bus_pirate.NoResponse("ERROR: No response")
+        return True
+
+    _, error_rate = bus_pirate.measure_link(workload, 4)
+    assert error_rate == 0.25
+
+
+def test_probe_binary_mode_from_i2c_mode(fake_port):
+    port = fake_port(mode="i2c")
+    assert bus_pirate.probe_binary_mode()
+    assert port.written == b"\x00" * 20 + b"\x0F" + b"\x00" * 21
+    assert port.mode == "binary"
+    assert bus_pirate.binary_mode
+    assert not bus_pirate.i2c_mode
+
+
+def test_probe_binary_mode_from_interactive_mode(fake_port):
+    port = fake_port(mode="interactive")
+    assert bus_pirate.probe_binary_mode()
+    assert port.mode == "binary"
+
+
+def test_probe_binary_mode_without_response(fake_port):
+    fake_port(dead=True)
+    assert not bus_pirate.probe_binary_mode()
+    assert not bus_pirate.binary_mode
+
+
+def test_enter_i2c_mode_applies_speed_when_already_in_i2c_mode(fake_port):
+    port = fake_port(mode="interactive")
+    bus_pirate.enter_i2c_mode()
+    assert port.i2c_speed == bus_pirate.I2C_SPEED_100KHZ
+    bus_pirate.enter_i2c_mode(bus_pirate.I2C_SPEED_400KHZ)
+    assert port.i2c_speed == bus_pirate.I2C_SPEED_400KHZ
+    bus_pirate.enter_i2c_mode()
+    assert port.i2c_speed == bus_pirate.I2C_SPEED_400KHZ
+
+
+def test_calibrate_picks_fastest_reliable_i2c_speed(fake_port):
+    port = fake_port(mode="interactive")
+
+    def workload(i):
+        return port.i2c_speed != bus_pirate.I2C_SPEED_400KHZ
+
+    profile = bus_pirate.calibrate("COMX", workload, iterations=4)
+    assert profile["i2c_speed"] == bus_pirate.I2C_SPEED_100KHZ
+    assert profile["error_rate"] == 0.0
+    assert port.mode == "i2c"
+    assert port.i2c_speed == bus_pirate.I2C_SPEED_100KHZ
+    assert bus_pirate.load_profile("COMX") == profile
+
+
+def test_calibrate_skips_speed_that_hangs(fake_port):
+    port = fake_port(mode="i2c", hang_speeds=[bus_pirate.I2C_SPEED_400KHZ])
+    profile = bus_pirate.calibrate("COMX", lambda i: True, iterations=4)
+    assert profile["i2c_speed"] == bus_pirate.I2C_SPEED_100KHZ
+    assert port.i2c_speed == bus_pirate.I2C_SPEED_100KHZ
+
+
+def test_calibrate_falls_back_when_nothing_is_reliable(fake_port):
+    port = fake_port(mode="interactive")
+    profile = bus_pirate.calibrate("COMX", lambda i: False, iterations=4)
+    assert profile is None
+    assert port.mode == "i2c"
+    assert port.i2c_speed == bus_pirate.I2C_SPEED_100KHZ
+    assert bus_pirate.load_profile("COMX") is None
+
+
+def test_profiles_round_trip_and_keep_other_ports(fake_port):
+    com1 = {"i2c_speed": bus_pirate.I2C_SPEED_400KHZ}
+    com2 = {"i2c_speed": bus_pirate.I2C_SPEED_50KHZ}
+    bus_pirate.save_profile("COM1", com1)
+    bus_pirate.save_profile("COM2", com2)
+    assert bus_pirate.load_profile("COM1") == com1
+    assert bus_pirate.load_profile("COM2") == com2
+    assert bus_pirate.load_profile("COM3") is None
+
+
+@pytest.mark.parametrize("content", [
+    "not json",
+    "[1, 2]",
+    json.dumps({"COM1": [3]}),
+    json.dumps({"COM1": {"throughput": 10.0}}),
+    json.dumps({"COM1": {"i2c_speed": 9}}),
+])
+def test_load_profile_rejects_unusable_content(fake_port, content):
+    with open(bus_pirate.PROFILE_FILE, "w") as f:
+        f.write(content)
+    assert bus_pirate.load_profile("COM1") is None
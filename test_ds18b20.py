@@ -19,6 +19,7 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import sys
 import time
 import bus_pirate
 from tracer import *
@@ -129,6 +130,12 @@ class DS2484:
     read_data_register = I2cFacade.I2cReadCommand(
         R_ADDR, prep_read_data_register, "DS2484 read data register")
 
+    prep_read_config_register = I2cFacade.I2cWriteCommand(
+        W_ADDR, b"\xE1" + Register.CONFIG)
+
+    read_config_register = I2cFacade.I2cReadCommand(
+        R_ADDR, prep_read_config_register, "DS2484 read config register")
+
     # Writes a new device configuration byte. The new settings take
     # effect immediately. Note: When writing to the Device Configuration
     # register, the new data is accepted only if the upper nibble (bits
@@ -242,6 +249,20 @@ class DS2484:
         tracer("DS2484 init")
         DS2484.reset()
 
+    @staticmethod
+    def verify_config(n):
+        """ Write a config register pattern and check it reads back.
+
+        :param n: Pattern number, the lower nibble is the config written
+        :return: True if the config read back matched
+
+        Used as the Bus Pirate link calibration workload. The config must
+        be rewritten afterwards, e.g. by DS18B20.init().
+        """
+        config = n & 0x0F
+        DS2484.write_config(bytes([((~config & 0x0F) << 4) | config]))
+        return DS2484.read_config_register()[0] == config
+
     @staticmethod
     def ow_write(data):
         DS2484.ow_new_transaction()
@@ -332,9 +353,14 @@ class DS18B20():
 
 
 if __name__ == '__main__':
-    bus_pirate.init("COM15", 115200)
-    bus_pirate.enter_i2c_mode()
+    port = "COM15"
+    bus_pirate.init(port, 115200)
     try:
+        # A saved I2C speed is only used if the Bus Pirate still answers.
+        profile = bus_pirate.load_profile(port)
+        if profile is None or "--calibrate" in sys.argv or \
+                not bus_pirate.restart_i2c_mode(profile["i2c_speed"]):
+            bus_pirate.calibrate(port, DS2484.verify_config)
         DS2484.init()
         DS18B20.init()
         id1 = [0x28, 0x23, 0x49, 0x83, 0x06, 0x00, 0x00, 0x6B]